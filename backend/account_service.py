@@ -0,0 +1,141 @@
+import logging
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy import and_, delete, or_, select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import AuthCode, Shelf, ShelfShare, User, UserAlbum, UserShard
+from shard_router import shard_router
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+class AccountService:
+    """Account deletion using set-based statements.
+
+    Child rows are removed with DELETE ... WHERE statements in bounded
+    batches rather than through the ORM cascade, which would load every
+    album, shelf and auth code into memory first. The ON DELETE CASCADE foreign
+    keys catch anything left behind.
+    """
+
+    @staticmethod
+    def _delete_user_rows(user_ids: List[int], db: Session, batch_size: int,
+                          condition=None) -> List[int]:
+        """Delete the given users and their child rows on one shard.
+
+        With `condition`, users that no longer match it are skipped: the rest
+        are re-selected and row-locked, and everything is deleted in one
+        transaction, so a user who logs in meanwhile keeps all their rows.
+        Returns the IDs of the users deleted.
+        """
+        if condition is not None:
+            user_ids = db.execute(
+                select(User.id).where(User.id.in_(user_ids), condition).with_for_update()
+            ).scalars().all()
+            if not user_ids:
+                db.commit()
+                return []
+
+        for model in (AuthCode, UserAlbum, Shelf):
+            while True:
+                batch = select(model.id).where(model.user_id.in_(user_ids)).limit(batch_size)
+                result = db.execute(
+                    delete(model).where(model.id.in_(batch.scalar_subquery())),
+                    execution_options={"synchronize_session": False}
+                )
+                if condition is None:
+                    db.commit()
+                if result.rowcount < batch_size:
+                    break
+
+        users = delete(User).where(User.id.in_(user_ids))
+        if condition is not None:
+            users = users.where(condition)
+        db.execute(users, execution_options={"synchronize_session": False})
+        db.commit()
+        return list(user_ids)
+
+    @staticmethod
+    def _delete_global_rows(user_ids: List[int], directory_db: Session):
+        """Remove share tokens and directory entries from the primary database"""
+        directory_db.execute(
+            delete(ShelfShare).where(ShelfShare.user_id.in_(user_ids)),
+            execution_options={"synchronize_session": False}
+        )
+        directory_db.execute(
+            delete(UserShard).where(UserShard.user_id.in_(user_ids)),
+            execution_options={"synchronize_session": False}
+        )
+        directory_db.commit()
+        for user_id in user_ids:
+            shard_router.invalidate(user_id)
+
+    @staticmethod
+    def delete_account(user_id: int, db: Session, directory_db: Session,
+                       batch_size: int = DEFAULT_BATCH_SIZE):
+        """Delete a user and everything they own"""
+        AccountService._delete_user_rows([user_id], db, batch_size)
+        AccountService._delete_global_rows([user_id], directory_db)
+        logger.info(f"Deleted account {user_id}")
+
+    @staticmethod
+    def purge_inactive_users(cutoff: datetime, batch_size: int = DEFAULT_BATCH_SIZE,
+                             dry_run: bool = False,
+                             progress: Optional[Callable[[int, int, int], None]] = None) -> int:
+        """Delete users who have not logged in since `cutoff`, on every shard.
+
+        Users who never logged in are purged once their account is older than
+        the cutoff. Each batch of users is committed separately, and
+        `progress(shard, deleted, total)` is called after every batch.
+        Returns the number of users deleted (or that would be, for a dry run).
+        """
+        inactive = or_(
+            User.last_login < cutoff,
+            and_(User.last_login.is_(None), User.created_at < cutoff)
+        )
+        purged = 0
+        directory_db = SessionLocal()
+
+        try:
+            for shard in range(shard_router.shard_count):
+                purged += AccountService._purge_shard(
+                    shard, inactive, directory_db, batch_size, dry_run, progress
+                )
+        finally:
+            directory_db.close()
+
+        return purged
+
+    @staticmethod
+    def _purge_shard(shard, inactive, directory_db, batch_size, dry_run, progress) -> int:
+        with shard_router.session_scope(shard) as db:
+            total = db.query(User).filter(inactive).count()
+            if dry_run or not total:
+                if progress:
+                    progress(shard, 0, total)
+                return total
+
+            deleted = 0
+            while True:
+                user_ids = [
+                    user_id for (user_id,) in
+                    db.execute(select(User.id).where(inactive).order_by(User.id).limit(batch_size))
+                ]
+                if not user_ids:
+                    break
+
+                # Someone may have logged in since the select; only users
+                # still inactive under the lock are deleted
+                user_ids = AccountService._delete_user_rows(user_ids, db, batch_size, inactive)
+                if user_ids:
+                    AccountService._delete_global_rows(user_ids, directory_db)
+
+                deleted += len(user_ids)
+                if progress:
+                    progress(shard, deleted, total)
+
+            return deleted
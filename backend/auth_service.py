@@ -1,6 +1,8 @@
 import logging
 from sqlalchemy.orm import Session
-from models import User, AuthCode
+from models import User, AuthCode, Shelf
+from shard_router import shard_router
+from starter_shelves import seed_starter_shelves
 from datetime import datetime, timedelta, timezone
 import jwt
 import os
@@ -39,16 +41,27 @@ class AuthService:
     """Authentication service using email codes"""
     
     @staticmethod
-    def request_login_code(email: str, db: Session):
-        """Send login code to user email"""
+    def request_login_code(email: str, directory_db: Session):
+        """Send login code to user email.
+        
+        `directory_db` is a primary database session; the user's own data is
+        read and written on their shard.
+        """
+        db = None
         try:
             # Normalize email
             email = email.lower().strip()
             
+            # Find the user's shard, registering new users in the directory
+            placement = shard_router.locate_email(email, directory_db, register=True)
+            if placement.migrating:
+                return {"success": False, "migrating": True, "error": "Account is being moved, please try again shortly"}
+            db = shard_router.session(placement.shard)
+            
             # Find or create user
             user = db.query(User).filter(User.email == email).first()
             if not user:
-                user = User(email=email)
+                user = User(id=placement.user_id, email=email)
                 db.add(user)
                 db.flush()  # Get user ID
             
@@ -73,18 +86,31 @@ class AuthService:
                 return {"success": False, "error": "Failed to send email"}
                 
         except Exception as e:
-            db.rollback()
+            directory_db.rollback()
+            if db:
+                db.rollback()
             logger.error(f"Error requesting login code: {str(e)}")
             return {"success": False, "error": "Internal server error"}
+        finally:
+            if db:
+                db.close()
     
     @staticmethod
-    def verify_login_code(email: str, code: str, db: Session):
+    def verify_login_code(email: str, code: str, directory_db: Session):
         """Verify login code and return JWT token"""
+        db = None
         try:
             # Normalize email
             email = email.lower().strip()
             
             # Find user
+            placement = shard_router.locate_email(email, directory_db)
+            if not placement:
+                return {"success": False, "error": "User not found"}
+            if placement.migrating:
+                return {"success": False, "migrating": True, "error": "Account is being moved, please try again shortly"}
+            db = shard_router.session(placement.shard)
+            
             user = db.query(User).filter(User.email == email).first()
             if not user:
                 return {"success": False, "error": "User not found"}
@@ -102,8 +128,19 @@ class AuthService:
             if auth_code.is_expired():
                 return {"success": False, "error": "Code has expired"}
             
-            # Mark code as used
-            auth_code.used = True
+            # Mark code as used; only one concurrent verification can claim it
+            claimed = db.query(AuthCode).filter(
+                AuthCode.id == auth_code.id,
+                AuthCode.used == False
+            ).update({AuthCode.used: True}, synchronize_session=False)
+            if not claimed:
+                return {"success": False, "error": "Invalid or expired code"}
+            
+            # Seed once the address is verified, in the same transaction that
+            # claims the code. Accounts from before seeding (or upgraded
+            # ones) already have shelves and are left alone.
+            if user.last_login is None and not db.query(Shelf.id).filter(Shelf.user_id == user.id).first():
+                seed_starter_shelves(user.id, db)
             
             # Update last login
             user.last_login = datetime.now(timezone.utc)
@@ -120,9 +157,13 @@ class AuthService:
             }
             
         except Exception as e:
-            db.rollback()
+            if db:
+                db.rollback()
             logger.error(f"Error verifying login code: {str(e)}")
             return {"success": False, "error": "Internal server error"}
+        finally:
+            if db:
+                db.close()
     
     @staticmethod
     def generate_token(user_id: int) -> str:
@@ -137,18 +178,12 @@ class AuthService:
         return jwt.encode(payload, secret_key, algorithm='HS256')
     
     @staticmethod
-    def verify_token(token: str, db: Session) -> Optional[User]:
-        """Verify JWT token and return user"""
+    def decode_token(token: str) -> Optional[int]:
+        """Verify a JWT token and return the user ID it was issued for"""
         try:
             secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
             payload = jwt.decode(token, secret_key, algorithms=['HS256'])
-            user_id = payload.get('user_id')
-            
-            if not user_id:
-                return None
-            
-            user = db.query(User).filter(User.id == user_id).first()
-            return user
+            return payload.get('user_id')
             
         except jwt.ExpiredSignatureError:
             logger.warning("Token expired")
@@ -156,6 +191,3 @@ class AuthService:
         except jwt.InvalidTokenError:
             logger.warning("Invalid token")
             return None
-        except Exception as e:
-            logger.error(f"Error verifying token: {str(e)}")
-            return None
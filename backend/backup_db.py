@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import NullPool
+from sqlalchemy.schema import AddConstraint, CreateIndex, CreateTable
+from dotenv import load_dotenv
+
+from models import Base
+
+load_dotenv()
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://localhost:5432/musikkhylla')
+ARCHIVE_VERSION = 1
+
+def table_names():
+    """Every table in the schema, parents before children"""
+    return [table.name for table in Base.metadata.sorted_tables]
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def open_snapshot_connection(engine):
+    """Raw psycopg2 connection whose transactions are read-only REPEATABLE READ"""
+    conn = engine.raw_connection()
+    conn.driver_connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    return conn
+
+def column_list(table):
+    return ', '.join(f'"{column.name}"' for column in Base.metadata.tables[table].columns)
+
+def export_table(engine, table, snapshot_id, workdir):
+    """COPY one table into a gzip file using the shared snapshot"""
+    path = os.path.join(workdir, f"{table}.csv.gz")
+    conn = open_snapshot_connection(engine)
+    try:
+        cursor = conn.cursor()
+        # Every table is read from the same snapshot, so the backup is
+        # consistent while the API keeps writing
+        cursor.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+        with gzip.open(path, 'wb') as out:
+            cursor.copy_expert(f'COPY "{table}" ({column_list(table)}) TO STDOUT WITH (FORMAT csv, HEADER)', out)
+        rows = cursor.rowcount
+        conn.rollback()
+    finally:
+        conn.close()
+
+    return {"table": table, "file": os.path.basename(path), "rows": rows, "sha256": sha256_file(path)}
+
+def backup(archive_path, database_url, workers):
+    engine = create_engine(database_url, poolclass=NullPool)
+    tables = [name for name in table_names() if inspect(engine).has_table(name)]
+    started = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Hold a transaction open so the other connections can import its snapshot
+        snapshot_conn = open_snapshot_connection(engine)
+        try:
+            cursor = snapshot_conn.cursor()
+            cursor.execute("SELECT pg_export_snapshot()")
+            snapshot_id = cursor.fetchone()[0]
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                entries = list(executor.map(
+                    lambda table: export_table(engine, table, snapshot_id, workdir), tables
+                ))
+        finally:
+            snapshot_conn.rollback()
+            snapshot_conn.close()
+
+        manifest = {
+            "version": ARCHIVE_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "tables": entries,
+        }
+        with tarfile.open(archive_path, 'w') as archive:
+            manifest_bytes = json.dumps(manifest, indent=2).encode('utf-8')
+            info = tarfile.TarInfo('manifest.json')
+            info.size = len(manifest_bytes)
+            archive.addfile(info, io.BytesIO(manifest_bytes))
+            for entry in entries:
+                archive.add(os.path.join(workdir, entry["file"]), arcname=entry["file"])
+
+    elapsed = time.perf_counter() - started
+    total_rows = sum(entry["rows"] for entry in entries)
+    for entry in entries:
+        print(f"  {entry['table']}: {entry['rows']} rows")
+    print(f"Backed up {total_rows} rows from {len(entries)} tables in {elapsed:.1f}s "
+          f"({total_rows / max(elapsed, 1e-9):.0f} rows/s) to {archive_path}")
+
+def import_table(engine, entry, workdir):
+    """COPY one table's archive file into the database"""
+    started = time.perf_counter()
+    path = os.path.join(workdir, entry["file"])
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        with gzip.open(path, 'rb') as source:
+            cursor.copy_expert(
+                f'COPY "{entry["table"]}" ({column_list(entry["table"])}) FROM STDIN WITH (FORMAT csv, HEADER)',
+                source
+            )
+        rows = cursor.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+
+    return entry["table"], rows, time.perf_counter() - started
+
+def restore(archive_path, database_url, workers):
+    engine = create_engine(database_url, poolclass=NullPool)
+    existing = [name for name in table_names() if inspect(engine).has_table(name)]
+    if existing:
+        raise SystemExit(f"Refusing to restore into a database that already has tables: {', '.join(existing)}")
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as workdir:
+        with tarfile.open(archive_path, 'r') as archive:
+            manifest = json.load(archive.extractfile('manifest.json'))
+            for entry in manifest["tables"]:
+                archive.extract(entry["file"], path=workdir)
+
+        for entry in manifest["tables"]:
+            if sha256_file(os.path.join(workdir, entry["file"])) != entry["sha256"]:
+                raise SystemExit(f"Checksum mismatch for {entry['file']}; archive is corrupt")
+
+        tables = [Base.metadata.tables[entry["table"]] for entry in manifest["tables"]]
+
+        # Bare tables first; indexes and foreign keys are built after the load
+        with engine.begin() as conn:
+            for table in tables:
+                conn.execute(CreateTable(table, include_foreign_key_constraints=[]))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda entry: import_table(engine, entry, workdir), manifest["tables"]
+            ))
+        load_elapsed = time.perf_counter() - started
+
+        print("Building indexes and constraints...")
+        with engine.begin() as conn:
+            for table in tables:
+                for index in table.indexes:
+                    conn.execute(CreateIndex(index))
+                for constraint in table.foreign_key_constraints:
+                    conn.execute(AddConstraint(constraint))
+
+                # COPY with explicit IDs doesn't advance the serial sequences
+                column = table.autoincrement_column
+                if column is not None:
+                    conn.execute(text(
+                        f"SELECT setval(pg_get_serial_sequence('{table.name}', '{column.name}'), "
+                        f"COALESCE((SELECT MAX(\"{column.name}\") FROM \"{table.name}\"), 0) + 1, false)"
+                    ))
+
+    total_rows = 0
+    for table, rows, elapsed in results:
+        total_rows += rows
+        print(f"  {table}: {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
+    total_elapsed = time.perf_counter() - started
+    print(f"Loaded {total_rows} rows in {load_elapsed:.1f}s "
+          f"({total_rows / max(load_elapsed, 1e-9):.0f} rows/s); "
+          f"restore finished in {total_elapsed:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up and restore the database with COPY")
+    parser.add_argument("--database-url", default=DATABASE_URL,
+                        help="Database to back up or restore into (defaults to DATABASE_URL)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Tables copied in parallel")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backup_parser = subparsers.add_parser("backup", help="Write a compressed, checksummed archive")
+    backup_parser.add_argument("archive")
+    restore_parser = subparsers.add_parser("restore", help="Load an archive into an empty database")
+    restore_parser.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "backup":
+        backup(args.archive, args.database_url, args.workers)
+    elif args.command == "restore":
+        restore(args.archive, args.database_url, args.workers)
@@ -11,6 +11,13 @@ SQLALCHEMY_DATABASE_URL = os.environ.get(
     'postgresql://localhost:5432/musikkhylla'
 )
 
+# Optional comma-separated list of databases holding user data. The primary
+# database above always holds the shard directory and other global tables.
+SHARD_DATABASE_URLS = [
+    url.strip() for url in os.environ.get('SHARD_DATABASE_URLS', '').split(',')
+    if url.strip()
+] or [SQLALCHEMY_DATABASE_URL]
+
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
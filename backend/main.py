@@ -1,21 +1,47 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi import FastAPI, Depends, HTTPException, Header, Request, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import func, inspect, select
 from sqlalchemy.orm import Session
 from typing import Optional, List
 import uvicorn
+import gzip
+import json
 import os
 
-from database import SessionLocal, engine, get_db
-from models import Base, User, UserAlbum
+from database import engine, get_db as get_directory_db
+from models import Base, User, UserAlbum, Shelf
 from schemas import (
     EmailRequest, CodeVerification, AuthResponse, UserResponse,
     AlbumCreate, AlbumUpdate, AlbumResponse, AlbumReorder,
-    MessageResponse, ErrorResponse
+    ShelfCreate, ShelfUpdate, ShelfResponse,
+    ShareResponse, MessageResponse, ErrorResponse
 )
 from auth_service import AuthService
+from share_service import ShareService
+from account_service import AccountService
+from single_flight import SingleFlight
+from shard_router import shard_router
+from query_profiler import (
+    PROFILING_ENABLED, TIMING_HEADERS_ENABLED, install_profiler, profile_request
+)
 
 # Create tables
 Base.metadata.create_all(bind=engine)
+for shard_engine in shard_router.engines:
+    if shard_engine is not engine:
+        Base.metadata.create_all(bind=shard_engine)
+
+# create_all leaves existing tables alone, so a database created before
+# shelves (user_albums.shelf_id) or users.albums_version must be upgraded
+# first; fail here rather than on the first request that touches them
+for shard_engine in dict.fromkeys([engine] + shard_router.engines):
+    inspector = inspect(shard_engine)
+    for table, column in (('users', 'albums_version'), ('user_albums', 'shelf_id')):
+        if column not in {c['name'] for c in inspector.get_columns(table)}:
+            raise RuntimeError(
+                f"{table}.{column} is missing in {shard_engine.url.render_as_string(hide_password=True)}; "
+                "run upgrade_db.py to upgrade the schema"
+            )
 
 app = FastAPI(
     title="Musikkhylla API",
@@ -30,13 +56,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-DB-Query-Count"] if TIMING_HEADERS_ENABLED else [],
 )
 
-# Authentication dependency
-async def get_current_user(
-    authorization: Optional[str] = Header(None),
-    db: Session = Depends(get_db)
-) -> User:
+# SQL query profiling (opt-in via SQL_PROFILING=1)
+if PROFILING_ENABLED:
+    install_profiler(engine)
+    for shard_engine in shard_router.engines:
+        install_profiler(shard_engine)
+
+    @app.middleware("http")
+    async def profile_sql_queries(request: Request, call_next):
+        with profile_request(request.method, request.scope, request.url.path) as profile:
+            response = await call_next(request)
+
+        if TIMING_HEADERS_ENABLED:
+            response.headers["Server-Timing"] = profile.server_timing()
+            response.headers["X-DB-Query-Count"] = str(profile.query_count)
+        return response
+
+# Authentication dependencies
+def get_token_user_id(authorization: Optional[str] = Header(None)) -> int:
     if not authorization:
         raise HTTPException(status_code=401, detail="No token provided")
     
@@ -44,27 +84,136 @@ async def get_current_user(
         raise HTTPException(status_code=401, detail="Invalid token format")
     
     token = authorization[7:]  # Remove "Bearer " prefix
-    user = AuthService.verify_token(token, db)
+    user_id = AuthService.decode_token(token)
+    
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    return user_id
+
+def account_moving_error() -> HTTPException:
+    """Temporary refusal while a user's data is moved between shards"""
+    return HTTPException(
+        status_code=503,
+        detail="Account is being moved, please try again shortly",
+        headers={"Retry-After": "10"}
+    )
+
+def get_db(request: Request, user_id: int = Depends(get_token_user_id)):
+    """Session on the shard holding the authenticated user's data"""
+    placement = shard_router.locate_user(user_id)
+    
+    # Writes are refused while the user is moved to another shard
+    if placement.migrating and request.method not in ("GET", "HEAD"):
+        raise account_moving_error()
+    
+    db = shard_router.session(placement.shard)
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_current_user(
+    user_id: int = Depends(get_token_user_id),
+    db: Session = Depends(get_db)
+) -> User:
+    user = db.query(User).filter(User.id == user_id).first()
     
     if not user:
         raise HTTPException(status_code=401, detail="Invalid token")
     
     return user
 
+# Concurrent reads of the same collection version share one query
+album_reads = SingleFlight("album_reads")
+
+def bump_albums_version(user: User):
+    """Mark the user's collection as changed; flushed with the next commit"""
+    user.albums_version = User.albums_version + 1
+
+DEFAULT_SHELF_NAME = "My Shelf"
+
+def get_default_shelf(user: User, db: Session) -> Shelf:
+    """The user's first shelf, created if they have none yet"""
+    shelf = db.query(Shelf).filter(
+        Shelf.user_id == user.id
+    ).order_by(Shelf.position, Shelf.id).first()
+    
+    if not shelf:
+        shelf = Shelf(user_id=user.id, name=DEFAULT_SHELF_NAME, position=0, album_count=0)
+        db.add(shelf)
+        db.commit()
+    
+    return shelf
+
+def get_user_shelf(shelf_id: int, user: User, db: Session) -> Shelf:
+    shelf = db.query(Shelf).filter(
+        Shelf.id == shelf_id,
+        Shelf.user_id == user.id
+    ).first()
+    
+    if not shelf:
+        raise HTTPException(status_code=404, detail="Shelf not found")
+    
+    return shelf
+
+def apply_album_order(album_ids: List[int], user: User, db: Session, shelf_id: Optional[int] = None):
+    """Set album positions from their order in `album_ids` with a single query"""
+    query = db.query(UserAlbum).filter(
+        UserAlbum.user_id == user.id,
+        UserAlbum.id.in_(album_ids)
+    )
+    if shelf_id is not None:
+        query = query.filter(UserAlbum.shelf_id == shelf_id)
+    albums_by_id = {album.id: album for album in query.all()}
+    
+    for index, album_id in enumerate(album_ids):
+        album = albums_by_id.get(album_id)
+        if album:
+            album.position = index
+
+def render_albums(user_id: int, shelf_id: Optional[int] = None) -> bytes:
+    """Load and serialize one shelf's albums in a session of its own.
+    
+    Without a shelf_id the user's first shelf is picked in a subquery, so
+    this is always a single query.
+    """
+    if shelf_id is None:
+        shelf = select(Shelf.id).where(
+            Shelf.user_id == user_id
+        ).order_by(Shelf.position, Shelf.id).limit(1).scalar_subquery()
+    else:
+        shelf = shelf_id
+    
+    with shard_router.session_scope(shard_router.locate_user(user_id).shard) as db:
+        user_albums = db.query(UserAlbum).filter(
+            UserAlbum.shelf_id == shelf,
+            UserAlbum.user_id == user_id
+        ).order_by(UserAlbum.position, UserAlbum.id).all()
+        
+        return json.dumps({"albums": [album.to_dict() for album in user_albums]}).encode('utf-8')
+
 @app.get("/api/health", response_model=MessageResponse)
 async def health():
     """Health check endpoint"""
     return {"message": "Musikkhylla API is running!"}
 
+@app.get("/api/metrics")
+async def metrics():
+    """Request coalescing counters"""
+    return {album_reads.name: album_reads.stats()}
+
 # Authentication endpoints
 @app.post("/api/auth/request-code", response_model=MessageResponse)
 async def request_login_code(
     request: EmailRequest,
-    db: Session = Depends(get_db)
+    directory_db: Session = Depends(get_directory_db)
 ):
     """Request a login code via email"""
-    result = AuthService.request_login_code(request.email, db)
+    result = AuthService.request_login_code(request.email, directory_db)
     
+    if result.get("migrating"):
+        raise account_moving_error()
     if not result["success"]:
         raise HTTPException(status_code=400, detail=result["error"])
     
@@ -73,11 +222,13 @@ async def request_login_code(
 @app.post("/api/auth/verify-code", response_model=AuthResponse)
 async def verify_login_code(
     request: CodeVerification,
-    db: Session = Depends(get_db)
+    directory_db: Session = Depends(get_directory_db)
 ):
     """Verify login code and return JWT token"""
-    result = AuthService.verify_login_code(request.email, request.code, db)
+    result = AuthService.verify_login_code(request.email, request.code, directory_db)
     
+    if result.get("migrating"):
+        raise account_moving_error()
     if not result["success"]:
         raise HTTPException(status_code=400, detail=result["error"])
     
@@ -91,132 +242,79 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
     """Get current user information"""
     return current_user
 
+@app.delete("/api/auth/me", response_model=MessageResponse)
+async def delete_account(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    directory_db: Session = Depends(get_directory_db)
+):
+    """Delete the current user's account and all of their albums"""
+    AccountService.delete_account(current_user.id, db, directory_db)
+    
+    return {"message": "Account deleted successfully"}
+
 # Album endpoints
 @app.get("/api/albums")
 async def get_albums(
+    shelf_id: Optional[int] = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get user's album collection"""
-    # Get user's albums, ordered by position
-    user_albums = db.query(UserAlbum).filter(
-        UserAlbum.user_id == current_user.id
-    ).order_by(UserAlbum.position).all()
-    
-    # If user has no albums, add some sample albums
-    if not user_albums:
-        sample_albums = [
-            {
-                'title': 'Abbey Road',
-                'artist': 'The Beatles',
-                'year': 1969,
-                'cover_url': 'https://via.placeholder.com/300x300/8B4513/FFFFFF?text=Abbey+Road',
-                'spotify_url': 'https://open.spotify.com/album/0ETFjACtuP2ADo6LFhL6HN',
-                'apple_music_url': '#',
-                'tidal_url': '#',
-                'position': 0
-            },
-            {
-                'title': 'Dark Side of the Moon',
-                'artist': 'Pink Floyd',
-                'year': 1973,
-                'cover_url': 'https://via.placeholder.com/300x300/000000/FFFFFF?text=Dark+Side',
-                'spotify_url': 'https://open.spotify.com/album/4LH4d3cOWNNsVw41Gqt2kv',
-                'apple_music_url': '#',
-                'tidal_url': '#',
-                'position': 1
-            },
-            {
-                'title': 'Nevermind',
-                'artist': 'Nirvana',
-                'year': 1991,
-                'cover_url': 'https://via.placeholder.com/300x300/4169E1/FFFFFF?text=Nevermind',
-                'spotify_url': 'https://open.spotify.com/album/2UJcKiJxNryhL050F5Z1Fk',
-                'apple_music_url': '#',
-                'tidal_url': '#',
-                'position': 2
-            },
-            {
-                'title': 'Back in Black',
-                'artist': 'AC/DC',
-                'year': 1980,
-                'cover_url': 'https://via.placeholder.com/300x300/000000/FFFFFF?text=Back+in+Black',
-                'spotify_url': 'https://open.spotify.com/album/6mUdeDZCsExyJLMdAfDuwh',
-                'apple_music_url': '#',
-                'tidal_url': '#',
-                'position': 3
-            },
-            {
-                'title': 'Thriller',
-                'artist': 'Michael Jackson',
-                'year': 1982,
-                'cover_url': 'https://via.placeholder.com/300x300/FF0000/FFFFFF?text=Thriller',
-                'spotify_url': 'https://open.spotify.com/album/2ANVost0y2y52ema1E9xAZ',
-                'apple_music_url': '#',
-                'tidal_url': '#',
-                'position': 4
-            }
-        ]
-        
-        # Add sample albums to database
-        for album_data in sample_albums:
-            album = UserAlbum(
-                user_id=current_user.id,
-                **album_data
-            )
-            db.add(album)
-        
-        db.commit()
-        
-        # Refresh the query
-        user_albums = db.query(UserAlbum).filter(
-            UserAlbum.user_id == current_user.id
-        ).order_by(UserAlbum.position).all()
+    """Get the albums on one shelf (the user's first shelf by default)"""
+    if shelf_id is not None:
+        shelf_id = get_user_shelf(shelf_id, current_user, db).id
+    
+    key = (current_user.id, current_user.albums_version, shelf_id)
     
-    albums_data = [album.to_dict() for album in user_albums]
-    return {"albums": albums_data}
+    # Give the connection back while waiting so coalesced requests don't
+    # starve the pool the shared read needs
+    db.close()
+    
+    # Albums ordered by position, shared with concurrent reads of the same version
+    albums_json = await album_reads.do(key, render_albums, current_user.id, shelf_id)
+    return Response(content=albums_json, media_type="application/json")
 
 @app.post("/api/albums", response_model=AlbumResponse)
 async def create_album(
     album: AlbumCreate,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Create a new album"""
-    # Get the next position
-    max_position = db.query(UserAlbum).filter(
-        UserAlbum.user_id == current_user.id
-    ).count()
+    """Create a new album at the end of a shelf"""
+    if album.shelf_id is None:
+        shelf = get_default_shelf(current_user, db)
+    else:
+        shelf = get_user_shelf(album.shelf_id, current_user, db)
     
     db_album = UserAlbum(
         user_id=current_user.id,
-        position=max_position,
-        **album.dict()
+        shelf_id=shelf.id,
+        position=shelf.album_count,
+        **album.dict(exclude={"shelf_id"})
     )
     db.add(db_album)
+    shelf.album_count = Shelf.album_count + 1
+    bump_albums_version(current_user)
     db.commit()
     db.refresh(db_album)
+    background_tasks.add_task(ShareService.refresh_snapshot, current_user.id)
     
     return db_album
 
 @app.post("/api/albums/reorder", response_model=MessageResponse)
 async def reorder_albums(
     reorder_data: AlbumReorder,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Update album positions"""
     try:
-        for index, album_data in enumerate(reorder_data.albums):
-            album = db.query(UserAlbum).filter(
-                UserAlbum.id == album_data.id,
-                UserAlbum.user_id == current_user.id
-            ).first()
-            
-            if album:
-                album.position = index
-        
+        apply_album_order([album.id for album in reorder_data.albums], current_user, db)
+        bump_albums_version(current_user)
         db.commit()
+        background_tasks.add_task(ShareService.refresh_snapshot, current_user.id)
         return {"message": "Album order updated successfully"}
     
     except Exception as e:
@@ -227,6 +325,7 @@ async def reorder_albums(
 async def update_album(
     album_id: int,
     album_update: AlbumUpdate,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -241,17 +340,32 @@ async def update_album(
     
     # Update only provided fields
     update_data = album_update.dict(exclude_unset=True)
+    
+    # Moving to another shelf puts the album at the end of that shelf
+    target_shelf_id = update_data.pop("shelf_id", None)
+    if target_shelf_id is not None and target_shelf_id != album.shelf_id:
+        target_shelf = get_user_shelf(target_shelf_id, current_user, db)
+        db.query(Shelf).filter(Shelf.id == album.shelf_id).update(
+            {Shelf.album_count: Shelf.album_count - 1}, synchronize_session=False
+        )
+        album.shelf_id = target_shelf.id
+        album.position = target_shelf.album_count
+        target_shelf.album_count = Shelf.album_count + 1
+    
     for field, value in update_data.items():
         setattr(album, field, value)
     
+    bump_albums_version(current_user)
     db.commit()
     db.refresh(album)
+    background_tasks.add_task(ShareService.refresh_snapshot, current_user.id)
     
     return album
 
 @app.delete("/api/albums/{album_id}", response_model=MessageResponse)
 async def delete_album(
     album_id: int,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -264,11 +378,184 @@ async def delete_album(
     if not album:
         raise HTTPException(status_code=404, detail="Album not found")
     
+    db.query(Shelf).filter(Shelf.id == album.shelf_id).update(
+        {Shelf.album_count: Shelf.album_count - 1}, synchronize_session=False
+    )
     db.delete(album)
+    bump_albums_version(current_user)
     db.commit()
+    background_tasks.add_task(ShareService.refresh_snapshot, current_user.id)
     
     return {"message": "Album deleted successfully"}
 
+# Shelf endpoints
+@app.get("/api/shelves")
+async def get_shelves(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """List the user's shelves without loading their albums.
+    
+    Users without shelves get an empty list; the default shelf is created by
+    the first album added, since reads must not write (they are still served
+    while a user is being moved between shards).
+    """
+    shelves = db.query(Shelf).filter(
+        Shelf.user_id == current_user.id
+    ).order_by(Shelf.position, Shelf.id).all()
+    
+    return {"shelves": [shelf.to_dict() for shelf in shelves]}
+
+@app.post("/api/shelves", response_model=ShelfResponse)
+async def create_shelf(
+    shelf: ShelfCreate,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Create a new shelf after the existing ones"""
+    max_position = db.query(func.max(Shelf.position)).filter(
+        Shelf.user_id == current_user.id
+    ).scalar()
+    
+    db_shelf = Shelf(
+        user_id=current_user.id,
+        name=shelf.name,
+        position=0 if max_position is None else max_position + 1,
+        album_count=0
+    )
+    db.add(db_shelf)
+    bump_albums_version(current_user)
+    db.commit()
+    db.refresh(db_shelf)
+    background_tasks.add_task(ShareService.refresh_snapshot, current_user.id)
+    
+    return db_shelf
+
+@app.put("/api/shelves/{shelf_id}", response_model=ShelfResponse)
+async def update_shelf(
+    shelf_id: int,
+    shelf_update: ShelfUpdate,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Rename a shelf"""
+    shelf = get_user_shelf(shelf_id, current_user, db)
+    
+    update_data = shelf_update.dict(exclude_unset=True)
+    for field, value in update_data.items():
+        setattr(shelf, field, value)
+    
+    bump_albums_version(current_user)
+    db.commit()
+    db.refresh(shelf)
+    background_tasks.add_task(ShareService.refresh_snapshot, current_user.id)
+    
+    return shelf
+
+@app.delete("/api/shelves/{shelf_id}", response_model=MessageResponse)
+async def delete_shelf(
+    shelf_id: int,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Delete a shelf and the albums on it"""
+    shelf = get_user_shelf(shelf_id, current_user, db)
+    
+    shelf_count = db.query(Shelf).filter(Shelf.user_id == current_user.id).count()
+    if shelf_count <= 1:
+        raise HTTPException(status_code=400, detail="Cannot delete your only shelf")
+    
+    db.query(UserAlbum).filter(UserAlbum.shelf_id == shelf.id).delete(synchronize_session=False)
+    db.delete(shelf)
+    bump_albums_version(current_user)
+    db.commit()
+    background_tasks.add_task(ShareService.refresh_snapshot, current_user.id)
+    
+    return {"message": "Shelf deleted successfully"}
+
+@app.get("/api/shelves/{shelf_id}/albums")
+async def get_shelf_albums(
+    shelf_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get the albums on a shelf"""
+    return await get_albums(shelf_id, current_user, db)
+
+@app.post("/api/shelves/{shelf_id}/albums/reorder", response_model=MessageResponse)
+async def reorder_shelf_albums(
+    shelf_id: int,
+    reorder_data: AlbumReorder,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Update album positions within a shelf"""
+    shelf = get_user_shelf(shelf_id, current_user, db)
+    
+    apply_album_order([album.id for album in reorder_data.albums], current_user, db, shelf.id)
+    bump_albums_version(current_user)
+    db.commit()
+    background_tasks.add_task(ShareService.refresh_snapshot, current_user.id)
+    
+    return {"message": "Album order updated successfully"}
+
+# Sharing endpoints
+@app.post("/api/share", response_model=ShareResponse)
+async def enable_sharing(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    directory_db: Session = Depends(get_directory_db)
+):
+    """Publish the user's shelf and return its share token"""
+    return ShareService.enable_sharing(current_user.id, db, directory_db)
+
+@app.delete("/api/share", response_model=MessageResponse)
+async def disable_sharing(
+    current_user: User = Depends(get_current_user),
+    directory_db: Session = Depends(get_directory_db)
+):
+    """Revoke the user's share token"""
+    if not ShareService.disable_sharing(current_user.id, directory_db):
+        raise HTTPException(status_code=404, detail="Shelf is not shared")
+    
+    return {"message": "Sharing disabled"}
+
+@app.get("/api/share/{token}")
+async def get_shared_shelf(
+    token: str,
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    directory_db: Session = Depends(get_directory_db)
+):
+    """Public, read-only view of a shared shelf served from its snapshot"""
+    share = ShareService.get_share(token, directory_db)
+    
+    if not share or share.snapshot is None:
+        raise HTTPException(status_code=404, detail="Shared shelf not found")
+    
+    # Serve the pre-compressed bytes as-is when the client accepts gzip
+    gzipped = ShareService.accepts_gzip(accept_encoding)
+    etag = ShareService.variant_etag(share.etag, gzipped)
+    
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=60, stale-while-revalidate=300",
+        "Vary": "Accept-Encoding",
+    }
+    
+    if ShareService.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=share.snapshot, media_type="application/json", headers=headers)
+    
+    return Response(content=gzip.decompress(share.snapshot), media_type="application/json", headers=headers)
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app", 
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, LargeBinary, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from datetime import datetime, timedelta, timezone
@@ -13,10 +13,15 @@ class User(Base):
     email = Column(String(120), unique=True, nullable=False, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     last_login = Column(DateTime(timezone=True))
+    # Bumped on every album change; identifies a version of the collection
+    albums_version = Column(Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
-    albums = relationship('UserAlbum', back_populates='user', cascade='all, delete-orphan')
-    auth_codes = relationship('AuthCode', back_populates='user', cascade='all, delete-orphan')
+    # passive_deletes leaves child rows to ON DELETE CASCADE instead of
+    # loading them before deleting a user
+    albums = relationship('UserAlbum', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
+    auth_codes = relationship('AuthCode', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
+    shelves = relationship('Shelf', back_populates='user', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'<User {self.email}>'
@@ -33,7 +38,7 @@ class AuthCode(Base):
     __tablename__ = 'auth_codes'
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     code = Column(String(6), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=False)
@@ -59,11 +64,42 @@ class AuthCode(Base):
     def is_valid(self):
         return not self.used and not self.is_expired()
 
+class Shelf(Base):
+    __tablename__ = 'shelves'
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    name = Column(String(100), nullable=False)
+    position = Column(Integer, default=0)
+    # Kept in step with the shelf's albums so summaries never count rows
+    album_count = Column(Integer, nullable=False, default=0, server_default='0')
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # Relationships
+    user = relationship('User', back_populates='shelves')
+    albums = relationship('UserAlbum', back_populates='shelf', passive_deletes=True)
+    
+    def __repr__(self):
+        return f'<Shelf {self.name}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'position': self.position,
+            'album_count': self.album_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 class UserAlbum(Base):
     __tablename__ = 'user_albums'
+    __table_args__ = (
+        Index('ix_user_albums_shelf_position', 'shelf_id', 'position'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    shelf_id = Column(Integer, ForeignKey('shelves.id', ondelete='CASCADE'), nullable=False)
     title = Column(String(200), nullable=False)
     artist = Column(String(200), nullable=False)
     year = Column(Integer)
@@ -76,6 +112,7 @@ class UserAlbum(Base):
     
     # Relationships
     user = relationship('User', back_populates='albums')
+    shelf = relationship('Shelf', back_populates='albums')
     
     def __repr__(self):
         return f'<UserAlbum {self.title} by {self.artist}>'
@@ -83,6 +120,7 @@ class UserAlbum(Base):
     def to_dict(self):
         return {
             'id': self.id,
+            'shelf_id': self.shelf_id,
             'title': self.title,
             'artist': self.artist,
             'year': self.year,
@@ -93,3 +131,56 @@ class UserAlbum(Base):
             'position': self.position,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+class ShelfShare(Base):
+    """Global table: lives in the primary database so tokens resolve without knowing the shard"""
+    __tablename__ = 'shelf_shares'
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, unique=True, nullable=False)
+    token = Column(String(43), unique=True, nullable=False, index=True)
+    snapshot = Column(LargeBinary)  # gzip-compressed JSON of the shelf
+    etag = Column(String(66))
+    # users.albums_version the snapshot was rendered from
+    rendered_version = Column(Integer, nullable=False, default=0, server_default='0')
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    generated_at = Column(DateTime(timezone=True))
+    
+    def __init__(self, user_id, **kwargs):
+        super().__init__(**kwargs)
+        self.user_id = user_id
+        self.token = self.generate_token()
+    
+    @staticmethod
+    def generate_token():
+        """Generate an unguessable URL-safe share token"""
+        return secrets.token_urlsafe(32)
+    
+    def __repr__(self):
+        return f'<ShelfShare {self.token}>'
+
+class UserShard(Base):
+    """Global table: maps each user to the shard holding their data.
+    
+    The autoincrementing user_id doubles as the allocator for user IDs, which
+    keeps them unique across shards.
+    """
+    __tablename__ = 'user_shards'
+    
+    user_id = Column(Integer, primary_key=True)
+    email = Column(String(120), unique=True, nullable=False, index=True)
+    shard = Column(Integer, nullable=False, default=0)
+    migrating = Column(Boolean, nullable=False, default=False)
+    
+    def __repr__(self):
+        return f'<UserShard {self.user_id} -> {self.shard}>'
+
+class IdBlock(Base):
+    """Global table: next free ID for per-user tables whose rows keep their IDs across shards"""
+    __tablename__ = 'id_blocks'
+    
+    table_name = Column(String(64), primary_key=True)
+    next_id = Column(Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<IdBlock {self.table_name} {self.next_id}>'
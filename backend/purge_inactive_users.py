@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from account_service import AccountService, DEFAULT_BATCH_SIZE
+
+def report_progress(shard, deleted, total):
+    if not total:
+        print(f"Shard {shard}: no inactive users")
+    elif not deleted:
+        print(f"Shard {shard}: {total} inactive users")
+    else:
+        print(f"Shard {shard}: deleted {deleted}/{total} users ({deleted / total:.0%})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete users who have not logged in for a while")
+    parser.add_argument("--days", type=int, required=True,
+                        help="Purge users whose last login is older than this many days")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Users (and child rows) deleted per statement")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only count the users that would be deleted")
+    args = parser.parse_args()
+
+    cutoff = datetime.now(timezone.utc) - timedelta(days=args.days)
+    print(f"Purging users inactive since {cutoff.isoformat()}...")
+    purged = AccountService.purge_inactive_users(
+        cutoff, batch_size=args.batch_size, dry_run=args.dry_run, progress=report_progress
+    )
+
+    if args.dry_run:
+        print(f"Dry run: {purged} users would be deleted.")
+    else:
+        print(f"Purge complete. Deleted {purged} users.")
@@ -0,0 +1,132 @@
+import contextvars
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Profiling is opt-in; the listeners add a little overhead to every statement
+PROFILING_ENABLED = os.environ.get('SQL_PROFILING', '').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_MS = float(os.environ.get('SQL_SLOW_QUERY_MS', '100'))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', '5'))
+TIMING_HEADERS_ENABLED = os.environ.get('SQL_PROFILING_HEADERS', '').lower() in ('1', 'true', 'yes')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_NUMBER_RE = re.compile(r'\b\d+\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\([^()]*\)', re.IGNORECASE)
+
+_current_profile = contextvars.ContextVar('sql_request_profile', default=None)
+
+
+def statement_shape(statement: str) -> str:
+    """Normalize a statement so repeated queries with different values compare equal"""
+    shape = _WHITESPACE_RE.sub(' ', statement).strip()
+    shape = _IN_LIST_RE.sub('IN (...)', shape)
+    return _NUMBER_RE.sub('?', shape)
+
+
+class RequestProfile:
+    """SQL statistics collected for a single request"""
+
+    def __init__(self, method: str, scope: Optional[dict] = None, path: str = ''):
+        self.method = method
+        self.scope = scope
+        self.path = path
+        self.query_count = 0
+        self.total_time = 0.0
+        self.shapes = Counter()
+
+    @property
+    def route(self) -> str:
+        # The router stores the matched route in the scope, which gives the
+        # templated path (/api/albums/{album_id}) instead of the raw URL
+        route = self.scope.get('route') if self.scope else None
+        path = getattr(route, 'path', None) or self.path
+        return f'{self.method} {path}'
+
+    @property
+    def total_ms(self) -> float:
+        return self.total_time * 1000
+
+    def record(self, statement: str, elapsed: float):
+        self.query_count += 1
+        self.total_time += elapsed
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated_statements(self, threshold: int = None):
+        """Statement shapes executed at least `threshold` times (likely N+1 patterns)"""
+        threshold = threshold or N_PLUS_ONE_THRESHOLD
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.total_ms:.1f};desc="{self.query_count} queries"'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_times', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('query_start_times')
+    if not start_times:
+        return
+    elapsed = time.perf_counter() - start_times.pop()
+
+    profile = _current_profile.get()
+    if profile is None:
+        return
+    profile.record(statement, elapsed)
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning(
+            f"Slow query ({elapsed * 1000:.1f} ms) on {profile.route}: "
+            f"{_WHITESPACE_RE.sub(' ', statement).strip()}"
+        )
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute is skipped for failing statements
+    start_times = exception_context.connection.info.get('query_start_times') if exception_context.connection else None
+    if start_times:
+        start_times.pop()
+
+
+def install_profiler(engine: Engine):
+    """Attach the timing listeners to an engine. Safe to call more than once."""
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+@contextmanager
+def profile_request(method: str, scope: Optional[dict] = None, path: str = ''):
+    """Collect SQL statistics for everything executed inside the block"""
+    profile = RequestProfile(method, scope, path)
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+        log_request_profile(profile)
+
+
+def log_request_profile(profile: RequestProfile):
+    if not profile.query_count:
+        return
+
+    logger.info(
+        f"{profile.route}: {profile.query_count} queries in {profile.total_ms:.1f} ms"
+    )
+    for shape, count in profile.repeated_statements():
+        logger.warning(
+            f"Possible N+1 on {profile.route}: statement executed {count} times: {shape}"
+        )
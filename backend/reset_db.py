@@ -8,19 +8,39 @@ load_dotenv()
 
 # Database connection
 DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql://localhost:5432/musikkhylla')
-engine = create_engine(DATABASE_URL)
+SHARD_DATABASE_URLS = [
+    url.strip() for url in os.environ.get('SHARD_DATABASE_URLS', '').split(',')
+    if url.strip()
+]
 
-def reset_database():
-    """Drop existing tables and recreate them with new schema"""
+# Children before parents. Global tables (shelf_shares, user_shards,
+# id_blocks) must go with the user tables, or a reused user ID would inherit
+# an old share token.
+TABLES = [
+    'user_albums',
+    'shelves',
+    'auth_codes',
+    'users',
+    'shelf_shares',
+    'user_shards',
+    'id_blocks',
+]
+
+def reset_database(database_url):
+    """Drop existing tables so the server recreates them with the new schema"""
+    engine = create_engine(database_url)
+    # SQLite (handy for local shard testing) has no DROP ... CASCADE
+    cascade = " CASCADE" if engine.dialect.name == 'postgresql' else ""
     with engine.connect() as conn:
         # Drop existing tables
-        print("Dropping existing tables...")
-        conn.execute(text("DROP TABLE IF EXISTS user_albums CASCADE"))
-        conn.execute(text("DROP TABLE IF EXISTS auth_codes CASCADE"))
-        conn.execute(text("DROP TABLE IF EXISTS users CASCADE"))
+        print(f"Dropping existing tables in {engine.url.render_as_string(hide_password=True)}...")
+        for table in TABLES:
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}{cascade}"))
         conn.commit()
         print("Tables dropped successfully!")
 
 if __name__ == "__main__":
-    reset_database()
-    print("Database reset complete. Restart the FastAPI server to create new tables.")
\ No newline at end of file
+    # The primary database and every shard are reset together
+    for url in dict.fromkeys([DATABASE_URL] + SHARD_DATABASE_URLS):
+        reset_database(url)
+    print("Database reset complete. Restart the FastAPI server to create new tables.")
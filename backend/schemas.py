@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List
 from datetime import datetime
 
@@ -34,9 +34,10 @@ class AlbumBase(BaseModel):
     tidal_url: Optional[str] = None
 
 class AlbumCreate(AlbumBase):
-    pass
+    shelf_id: Optional[int] = None
 
 class AlbumUpdate(BaseModel):
+    shelf_id: Optional[int] = None
     title: Optional[str] = None
     artist: Optional[str] = None
     year: Optional[int] = None
@@ -47,6 +48,7 @@ class AlbumUpdate(BaseModel):
 
 class AlbumResponse(AlbumBase):
     id: int
+    shelf_id: Optional[int] = None
     position: int
     created_at: Optional[datetime] = None
 
@@ -56,6 +58,32 @@ class AlbumResponse(AlbumBase):
 class AlbumReorder(BaseModel):
     albums: List[AlbumResponse]
 
+# Shelf schemas
+class ShelfCreate(BaseModel):
+    name: str = Field(min_length=1, max_length=100)
+
+class ShelfUpdate(BaseModel):
+    # Omit to leave unchanged; an explicit null is rejected (the column is NOT NULL)
+    name: str = Field(None, min_length=1, max_length=100)
+
+class ShelfResponse(BaseModel):
+    id: int
+    name: str
+    position: int
+    album_count: int
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# Share schemas
+class ShareResponse(BaseModel):
+    token: str
+    generated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
 # Response schemas
 class MessageResponse(BaseModel):
     message: str
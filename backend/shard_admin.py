@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+from sqlalchemy import func, text
+
+from database import SessionLocal, engine
+from models import AuthCode, Base, Shelf, User, UserAlbum, UserShard
+from shard_router import DIRECTORY_CACHE_TTL, GLOBAL_ID_TABLES, shard_router
+
+# Per-user tables, copied after the users row with parents first. Shelves
+# and albums keep their IDs, which are unique across shards, so clients
+# holding them are unaffected by a move; auth codes get new IDs.
+USER_TABLES = [
+    (AuthCode.__table__, AuthCode.user_id),
+    (Shelf.__table__, Shelf.user_id),
+    (UserAlbum.__table__, UserAlbum.user_id),
+]
+
+def wait_for_caches():
+    """Give every API process time to drop its cached directory entry"""
+    delay = DIRECTORY_CACHE_TTL + 1
+    print(f"Waiting {delay:.0f}s for directory caches to expire...")
+    time.sleep(delay)
+
+def create_tables():
+    """Create the schema on the primary database and every shard"""
+    Base.metadata.create_all(bind=engine)
+    for shard_engine in shard_router.engines:
+        Base.metadata.create_all(bind=shard_engine)
+
+def show_status():
+    """Print the number of users on each shard"""
+    directory_db = SessionLocal()
+    try:
+        counts = dict(
+            directory_db.query(UserShard.shard, func.count(UserShard.user_id))
+            .group_by(UserShard.shard).all()
+        )
+        migrating = directory_db.query(UserShard).filter(UserShard.migrating == True).count()
+    finally:
+        directory_db.close()
+
+    for shard in range(shard_router.shard_count):
+        with shard_router.session_scope(shard) as db:
+            stored = db.query(User).count()
+        print(f"Shard {shard}: {counts.get(shard, 0)} users in directory, {stored} stored")
+    print(f"Users being moved: {migrating}")
+
+def backfill_directory():
+    """Register existing users in the shard directory.
+
+    Run once before adding a second shard: users created while unsharded got
+    their IDs from the users table and have no directory entry.
+    """
+    directory_db = SessionLocal()
+    try:
+        known = {user_id for (user_id,) in directory_db.query(UserShard.user_id).all()}
+        added = 0
+        for shard in range(shard_router.shard_count):
+            with shard_router.session_scope(shard) as db:
+                for user_id, email in db.query(User.id, User.email).all():
+                    if user_id in known:
+                        continue
+                    directory_db.add(UserShard(user_id=user_id, email=email, shard=shard, migrating=False))
+                    known.add(user_id)
+                    added += 1
+        directory_db.commit()
+
+        # Explicit IDs don't advance the sequence; move it past them
+        if engine.dialect.name == 'postgresql' and known:
+            directory_db.execute(text(
+                "SELECT setval(pg_get_serial_sequence('user_shards', 'user_id'), :max_id)"
+            ), {"max_id": max(known)})
+            directory_db.commit()
+
+        print(f"Added {added} users to the shard directory")
+    finally:
+        directory_db.close()
+
+def copy_user(user_id: int, source: int, target: int) -> int:
+    """Copy a user's rows from one shard to another, replacing any partial copy"""
+    copied = 0
+    source_engine = shard_router.engines[source]
+    target_engine = shard_router.engines[target]
+
+    with source_engine.connect() as source_conn, target_engine.begin() as target_conn:
+        # Clear leftovers from an earlier interrupted move
+        for table, user_column in reversed(USER_TABLES):
+            target_conn.execute(table.delete().where(user_column == user_id))
+        target_conn.execute(User.__table__.delete().where(User.id == user_id))
+
+        user_row = source_conn.execute(
+            User.__table__.select().where(User.id == user_id)
+        ).mappings().first()
+        if not user_row:
+            raise ValueError(f"User {user_id} not found on shard {source}")
+        target_conn.execute(User.__table__.insert(), [dict(user_row)])
+
+        for table, user_column in USER_TABLES:
+            rows = [
+                dict(row) if table in GLOBAL_ID_TABLES
+                else {key: value for key, value in row.items() if key != 'id'}
+                for row in source_conn.execute(table.select().where(user_column == user_id)).mappings()
+            ]
+            if rows:
+                target_conn.execute(table.insert(), rows)
+            copied += len(rows)
+
+    return copied
+
+def delete_user_rows(user_id: int, shard: int):
+    with shard_router.engines[shard].begin() as conn:
+        for table, user_column in reversed(USER_TABLES):
+            conn.execute(table.delete().where(user_column == user_id))
+        conn.execute(User.__table__.delete().where(User.id == user_id))
+
+def move_user(user_id: int, target: int):
+    """Move a user to another shard while the API keeps running.
+
+    Reads keep being served from the source shard throughout. Writes for the
+    user are refused (503) between marking the entry as migrating and
+    clearing the flag.
+    """
+    if not 0 <= target < shard_router.shard_count:
+        raise ValueError(f"Shard {target} does not exist")
+
+    directory_db = SessionLocal()
+    try:
+        entry = directory_db.query(UserShard).filter(UserShard.user_id == user_id).first()
+        if not entry:
+            raise ValueError(f"User {user_id} is not in the shard directory; run backfill first")
+        source = entry.shard
+        if source == target:
+            print(f"User {user_id} is already on shard {target}")
+            return
+
+        print(f"Moving user {user_id} from shard {source} to shard {target}")
+        entry.migrating = True
+        directory_db.commit()
+        wait_for_caches()
+
+        try:
+            copied = copy_user(user_id, source, target)
+        except Exception:
+            # Leave the user on the source shard and writable again
+            directory_db.rollback()
+            entry.migrating = False
+            directory_db.commit()
+            raise
+        print(f"Copied user and {copied} rows")
+
+        # Point the directory at the target but keep blocking writes until
+        # no process can still be routing to the source
+        entry.shard = target
+        directory_db.commit()
+        wait_for_caches()
+
+        entry.migrating = False
+        directory_db.commit()
+    finally:
+        directory_db.close()
+
+    delete_user_rows(user_id, source)
+    print(f"Move complete; removed user {user_id} from shard {source}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage user data shards")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("init", help="Create tables on the primary database and every shard")
+    subparsers.add_parser("status", help="Show how users are spread across shards")
+    subparsers.add_parser("backfill", help="Register existing users in the shard directory")
+    move_parser = subparsers.add_parser("move", help="Move a user to another shard")
+    move_parser.add_argument("user_id", type=int)
+    move_parser.add_argument("shard", type=int)
+    args = parser.parse_args()
+
+    if args.command == "init":
+        create_tables()
+        print("Tables created.")
+    elif args.command == "status":
+        show_status()
+    elif args.command == "backfill":
+        backfill_directory()
+    elif args.command == "move":
+        move_user(args.user_id, args.shard)
@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import List, Optional
+
+from sqlalchemy import create_engine, event, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import SQLALCHEMY_DATABASE_URL, SHARD_DATABASE_URLS, SessionLocal, engine
+from models import Base, IdBlock, Shelf, UserAlbum, UserShard
+
+# How long a process trusts a cached directory entry. Moves wait this long
+# between steps so every process sees the new state.
+DIRECTORY_CACHE_TTL = float(os.environ.get('SHARD_DIRECTORY_TTL', '5'))
+
+# shard: index into SHARD_DATABASE_URLS
+# user_id: global user ID, or None when the database is not sharded
+# migrating: True while the user is being moved; writes must be refused
+Placement = namedtuple('Placement', ['shard', 'user_id', 'migrating'])
+
+# Tables whose IDs clients hold on to; with several shards their rows get
+# cluster-wide IDs so they can move between shards unchanged
+GLOBAL_ID_TABLES = (Shelf.__table__, UserAlbum.__table__)
+
+# IDs reserved per trip to the id_blocks table; a restart skips the unused rest
+ID_BLOCK_SIZE = int(os.environ.get('SHARD_ID_BLOCK_SIZE', '100'))
+
+class ShardRouter:
+    """Routes user data to one of several databases by user ID.
+
+    With a single shard no directory lookups are made and user IDs come from
+    the users table as before. With several shards, the user_shards directory
+    in the primary database records where each user lives. Users missing from
+    the directory predate sharding and live on shard 0; run
+    `shard_admin.py backfill` before adding a second shard so existing
+    accounts get directory entries.
+
+    Shelves and albums keep their IDs when a user is moved, so with several
+    shards their IDs come from the id_blocks table rather than from each
+    shard's own sequence (see GLOBAL_ID_TABLES). Reserving a block writes to
+    the primary database during a shard transaction, so with SQLite the
+    primary must be a separate file from the shards.
+    """
+
+    def __init__(self, shard_urls):
+        self.engines = [
+            engine if url == SQLALCHEMY_DATABASE_URL else create_engine(url)
+            for url in shard_urls
+        ]
+        self.sessionmakers = [
+            sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+            for shard_engine in self.engines
+        ]
+        self._cache = {}
+        self._next_prune = 0.0
+        self._id_blocks = {}
+        self._id_lock = threading.Lock()
+        # Blocks are reserved while a request holds a pooled connection; a
+        # separate unpooled engine can't be starved by those requests
+        self._id_sessionmaker = sessionmaker(
+            autocommit=False, autoflush=False,
+            bind=create_engine(SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+        )
+
+    @property
+    def shard_count(self) -> int:
+        return len(self.engines)
+
+    @property
+    def is_sharded(self) -> bool:
+        return self.shard_count > 1
+
+    def session(self, shard: int) -> Session:
+        return self.sessionmakers[shard]()
+
+    @contextmanager
+    def session_scope(self, shard: int):
+        db = self.session(shard)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def shard_for_new_user(self, email: str) -> int:
+        """Pick a shard for a new account (stable hash of the email)"""
+        return zlib.crc32(email.encode('utf-8')) % self.shard_count
+
+    def locate_user(self, user_id: int) -> Placement:
+        """Find the shard holding a user's data, using a short-lived cache"""
+        if not self.is_sharded:
+            return Placement(0, user_id, False)
+
+        now = time.monotonic()
+        cached = self._cache.get(user_id)
+        if cached and cached[1] > now:
+            return cached[0]
+
+        directory_db = SessionLocal()
+        try:
+            entry = directory_db.query(UserShard).filter(UserShard.user_id == user_id).first()
+        finally:
+            directory_db.close()
+
+        placement = Placement(entry.shard, user_id, entry.migrating) if entry else Placement(0, user_id, False)
+        self._prune(now)
+        self._cache[user_id] = (placement, now + DIRECTORY_CACHE_TTL)
+        return placement
+
+    def _prune(self, now: float):
+        """Drop expired entries, at most once per TTL, so the cache only holds recently active users"""
+        if now < self._next_prune:
+            return
+        self._cache = {
+            user_id: cached for user_id, cached in self._cache.items() if cached[1] > now
+        }
+        self._next_prune = now + DIRECTORY_CACHE_TTL
+
+    def locate_email(self, email: str, directory_db: Session, register: bool = False) -> Optional[Placement]:
+        """Find the shard for an email, optionally registering a new user.
+
+        Returns None for unknown emails when `register` is False. Registering
+        commits the directory entry so the new user ID is allocated.
+        """
+        if not self.is_sharded:
+            return Placement(0, None, False)
+
+        entry = directory_db.query(UserShard).filter(UserShard.email == email).first()
+        if not entry:
+            if not register:
+                return None
+            entry = UserShard(email=email, shard=self.shard_for_new_user(email), migrating=False)
+            directory_db.add(entry)
+            try:
+                directory_db.commit()
+            except IntegrityError:
+                # A concurrent request registered the same email first
+                directory_db.rollback()
+                entry = directory_db.query(UserShard).filter(UserShard.email == email).one()
+
+        return Placement(entry.shard, entry.user_id, entry.migrating)
+
+    def invalidate(self, user_id: int):
+        self._cache.pop(user_id, None)
+
+    def allocate_ids(self, table: str, count: int) -> List[int]:
+        """Reserve `count` IDs for `table` that are unique across every shard"""
+        ids = []
+        with self._id_lock:
+            while len(ids) < count:
+                start, end = self._id_blocks.get(table, (0, 0))
+                if start >= end:
+                    start, end = self._reserve_block(table, max(ID_BLOCK_SIZE, count - len(ids)))
+                taken = min(end - start, count - len(ids))
+                ids.extend(range(start, start + taken))
+                self._id_blocks[table] = (start + taken, end)
+        return ids
+
+    def _reserve_block(self, table: str, size: int):
+        directory_db = self._id_sessionmaker()
+        try:
+            while True:
+                block = directory_db.query(IdBlock).filter(
+                    IdBlock.table_name == table
+                ).with_for_update().first()
+                if block:
+                    break
+                # First allocation: start past rows created before sharding
+                directory_db.add(IdBlock(table_name=table, next_id=self._max_id(table) + 1))
+                try:
+                    directory_db.commit()
+                except IntegrityError:
+                    # Another process created the row first
+                    directory_db.rollback()
+
+            start = block.next_id
+            block.next_id = start + size
+            directory_db.commit()
+            return start, start + size
+        finally:
+            directory_db.close()
+
+    def _max_id(self, table: str) -> int:
+        column = Base.metadata.tables[table].c.id
+        highest = 0
+        for shard in range(self.shard_count):
+            with self.session_scope(shard) as db:
+                highest = max(highest, db.execute(select(func.max(column))).scalar() or 0)
+        return highest
+
+
+shard_router = ShardRouter(SHARD_DATABASE_URLS)
+
+
+@event.listens_for(Shelf, 'before_insert')
+@event.listens_for(UserAlbum, 'before_insert')
+def assign_global_id(mapper, connection, target):
+    """Give new shelves and albums cluster-wide IDs when sharded"""
+    if target.id is None and shard_router.is_sharded:
+        target.id = shard_router.allocate_ids(mapper.local_table.name, 1)[0]
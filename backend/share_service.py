@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Shelf, ShelfShare, User, UserAlbum
+from shard_router import shard_router
+
+logger = logging.getLogger(__name__)
+
+class ShareService:
+    """Public read-only shelf sharing backed by pre-rendered snapshots.
+    
+    Share rows live in the primary database so public tokens resolve without
+    knowing the owner's shard; albums are read from the owner's shard.
+    """
+
+    @staticmethod
+    def render_snapshot(user_id: int, db: Session):
+        """Serialize the user's shelves and return (gzip bytes, strong ETag, version).
+
+        The collection version is read first, so the rendered shelves are at
+        least as new as the version returned.
+        """
+        version = db.query(User.albums_version).filter(User.id == user_id).scalar() or 0
+        shelves = db.query(Shelf).filter(
+            Shelf.user_id == user_id
+        ).order_by(Shelf.position, Shelf.id).all()
+        user_albums = db.query(UserAlbum).join(Shelf).filter(
+            UserAlbum.user_id == user_id
+        ).order_by(Shelf.position, Shelf.id, UserAlbum.position, UserAlbum.id).all()
+
+        payload = json.dumps(
+            {
+                "shelves": [shelf.to_dict() for shelf in shelves],
+                "albums": [album.to_dict() for album in user_albums],
+            },
+            separators=(',', ':')
+        ).encode('utf-8')
+
+        # mtime=0 keeps the compressed bytes stable for identical shelves
+        compressed = gzip.compress(payload, mtime=0)
+        etag = f'"{hashlib.sha256(payload).hexdigest()}"'
+        return compressed, etag, version
+
+    @staticmethod
+    def enable_sharing(user_id: int, db: Session, directory_db: Session) -> ShelfShare:
+        """Create (or return the existing) share for a user's shelf"""
+        share = directory_db.query(ShelfShare).filter(ShelfShare.user_id == user_id).first()
+        if share:
+            return share
+
+        share = ShelfShare(user_id=user_id)
+        share.snapshot, share.etag, share.rendered_version = ShareService.render_snapshot(user_id, db)
+        share.generated_at = datetime.now(timezone.utc)
+        directory_db.add(share)
+        try:
+            directory_db.commit()
+        except IntegrityError:
+            # A concurrent request shared the shelf first
+            directory_db.rollback()
+            return directory_db.query(ShelfShare).filter(ShelfShare.user_id == user_id).one()
+        directory_db.refresh(share)
+        return share
+
+    @staticmethod
+    def disable_sharing(user_id: int, directory_db: Session) -> bool:
+        """Revoke the user's share token. Returns False if nothing was shared."""
+        deleted = directory_db.query(ShelfShare).filter(ShelfShare.user_id == user_id).delete()
+        directory_db.commit()
+        return bool(deleted)
+
+    @staticmethod
+    def get_share(token: str, directory_db: Session) -> Optional[ShelfShare]:
+        return directory_db.query(ShelfShare).filter(ShelfShare.token == token).first()
+
+    @staticmethod
+    def refresh_snapshot(user_id: int):
+        """Regenerate a shared shelf snapshot after the owner changes albums.
+
+        Runs as a background task after the response is sent, so it uses its
+        own sessions rather than the request's. Tasks for quick successive
+        edits run concurrently; a render only replaces the stored snapshot
+        if it comes from a newer collection version.
+        """
+        directory_db = SessionLocal()
+        try:
+            shared = directory_db.query(ShelfShare.id).filter(ShelfShare.user_id == user_id).first()
+            if not shared:
+                return
+
+            with shard_router.session_scope(shard_router.locate_user(user_id).shard) as db:
+                snapshot, etag, version = ShareService.render_snapshot(user_id, db)
+
+            directory_db.query(ShelfShare).filter(
+                ShelfShare.user_id == user_id,
+                ShelfShare.rendered_version < version
+            ).update({
+                ShelfShare.snapshot: snapshot,
+                ShelfShare.etag: etag,
+                ShelfShare.rendered_version: version,
+                ShelfShare.generated_at: datetime.now(timezone.utc),
+            }, synchronize_session=False)
+            directory_db.commit()
+        except Exception as e:
+            directory_db.rollback()
+            logger.error(f"Error refreshing shelf snapshot for user {user_id}: {str(e)}")
+        finally:
+            directory_db.close()
+
+    @staticmethod
+    def variant_etag(etag: str, gzipped: bool) -> str:
+        """ETag for one content-coding of a snapshot.
+        
+        Strong validators must differ between encodings, so the gzip variant
+        gets a suffix and caches never revalidate one encoding with the other.
+        """
+        if not gzipped:
+            return etag
+        return f'{etag[:-1]}-gzip"'
+
+    @staticmethod
+    def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+        """Whether an Accept-Encoding header allows gzip.
+
+        An explicit gzip entry wins over `*`, and q=0 refuses the coding.
+        """
+        if not accept_encoding:
+            return False
+        weights = {}
+        for entry in accept_encoding.split(','):
+            coding, *params = [part.strip() for part in entry.split(';')]
+            quality = 1.0
+            for param in params:
+                name, _, value = param.partition('=')
+                if name.strip().lower() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            weights[coding.lower()] = quality
+        for coding in ('gzip', 'x-gzip', '*'):
+            if coding in weights:
+                return weights[coding] > 0
+        return False
+
+    @staticmethod
+    def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+        """Check an If-None-Match header against the ETag of the variant being served"""
+        if not if_none_match or not etag:
+            return False
+        candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+        return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
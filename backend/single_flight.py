@@ -0,0 +1,44 @@
+import asyncio
+from typing import Any, Callable, Dict, Hashable
+
+from starlette.concurrency import run_in_threadpool
+
+class SingleFlight:
+    """Coalesces concurrent identical calls into one execution.
+
+    The first caller for a key runs `fn` in the threadpool; callers arriving
+    with the same key while it is running await the same result instead of
+    running it again. Keys should include everything the result depends on
+    (e.g. a collection version) so later calls never see stale results.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[..., Any], *args) -> Any:
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(self._run(key, fn, *args))
+            self._in_flight[key] = task
+        else:
+            self.coalesced += 1
+
+        # shield: one caller disconnecting must not cancel the shared call
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, fn: Callable[..., Any], *args) -> Any:
+        try:
+            return await run_in_threadpool(fn, *args)
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,91 @@
+import json
+import os
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from models import Shelf, UserAlbum
+from shard_router import shard_router
+
+STARTER_SHELVES_PATH = os.environ.get(
+    'STARTER_SHELVES_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'starter_shelves.json')
+)
+
+# Columns a template album may set; the rest are filled in when seeding
+TEMPLATE_ALBUM_FIELDS = {
+    column.name for column in UserAlbum.__table__.columns
+} - {'id', 'user_id', 'shelf_id', 'position', 'created_at'}
+REQUIRED_ALBUM_FIELDS = {'title', 'artist'}
+
+def validate_starter_shelves(templates, path: str):
+    """Check templates against the columns they are inserted into.
+
+    Raises ValueError naming the first bad shelf or album, so a broken file
+    stops the server at startup instead of failing every signup.
+    """
+    if not isinstance(templates, list):
+        raise ValueError(f"{path}: expected a list of shelves")
+
+    for index, template in enumerate(templates):
+        if not isinstance(template, dict) or not template.get('name'):
+            raise ValueError(f"{path}: shelf {index} has no name")
+        if len(template['name']) > Shelf.__table__.c.name.type.length:
+            raise ValueError(f"{path}: name of shelf {index} is too long")
+        albums = template.get('albums', [])
+        if not isinstance(albums, list):
+            raise ValueError(f"{path}: albums of shelf {template['name']!r} must be a list")
+
+        for position, album in enumerate(albums):
+            where = f"{path}: album {position} on shelf {template['name']!r}"
+            if not isinstance(album, dict):
+                raise ValueError(f"{where} is not an object")
+            unknown = album.keys() - TEMPLATE_ALBUM_FIELDS
+            if unknown:
+                raise ValueError(f"{where} has unknown fields: {', '.join(sorted(unknown))}")
+            missing = {field for field in REQUIRED_ALBUM_FIELDS if not album.get(field)}
+            if missing:
+                raise ValueError(f"{where} is missing {', '.join(sorted(missing))}")
+
+def load_starter_shelves(path: str = STARTER_SHELVES_PATH):
+    """Read and validate the shelf templates new accounts start with"""
+    with open(path) as f:
+        templates = json.load(f)
+    validate_starter_shelves(templates, path)
+    return templates
+
+# Loaded once at startup rather than on every signup; a missing or invalid
+# file raises here and stops the server
+STARTER_SHELVES = load_starter_shelves()
+
+def seed_starter_shelves(user_id: int, db: Session, templates=None):
+    """Add the starter shelves and albums for a newly verified user.
+
+    Shelves are flushed to get their IDs, then all albums go in with one
+    bulk INSERT. Nothing is committed; callers seed in the same transaction
+    that claims the user's first login code, so a user is never seeded twice.
+    """
+    templates = STARTER_SHELVES if templates is None else templates
+    if not templates:
+        return
+
+    shelves = [
+        Shelf(user_id=user_id, name=template['name'], position=index,
+              album_count=len(template.get('albums', [])))
+        for index, template in enumerate(templates)
+    ]
+    db.add_all(shelves)
+    db.flush()  # Get shelf IDs
+
+    album_rows = [
+        dict(album, user_id=user_id, shelf_id=shelf.id, position=position)
+        for shelf, template in zip(shelves, templates)
+        for position, album in enumerate(template.get('albums', []))
+    ]
+    if album_rows:
+        # Bulk inserts skip the ORM hook that assigns sharded IDs
+        if shard_router.is_sharded:
+            album_ids = shard_router.allocate_ids(UserAlbum.__tablename__, len(album_rows))
+            for row, album_id in zip(album_rows, album_ids):
+                row['id'] = album_id
+        db.execute(insert(UserAlbum), album_rows)
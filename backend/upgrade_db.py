@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+from sqlalchemy import inspect, select, text
+
+from database import engine
+from models import AuthCode, Base, Shelf, User, UserAlbum
+from shard_router import shard_router
+
+DEFAULT_SHELF_NAME = "My Shelf"
+
+# Columns added to existing tables since they were first created. create_all
+# only creates missing tables, so these are added here.
+NEW_COLUMNS = [
+    ('users', 'albums_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('user_albums', 'shelf_id', 'INTEGER REFERENCES shelves (id) ON DELETE CASCADE'),
+    ('shelf_shares', 'rendered_version', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# Foreign keys that gained ON DELETE CASCADE (PostgreSQL only; SQLite can't
+# alter constraints, and account deletion removes child rows itself)
+CASCADE_FOREIGN_KEYS = [
+    ('auth_codes', 'user_id', 'users'),
+    ('user_albums', 'user_id', 'users'),
+]
+
+def add_missing_columns(db_engine):
+    inspector = inspect(db_engine)
+    with db_engine.begin() as conn:
+        for table, column, definition in NEW_COLUMNS:
+            if not inspector.has_table(table):
+                continue
+            if column in {c['name'] for c in inspector.get_columns(table)}:
+                continue
+            print(f"  Adding {table}.{column}")
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+def create_default_shelves(db_engine):
+    """Give every user without shelves a default shelf holding their albums"""
+    with db_engine.connect() as conn:
+        user_ids = conn.execute(
+            select(User.id).where(~select(Shelf.id).where(Shelf.user_id == User.id).exists())
+        ).scalars().all()
+
+    if user_ids:
+        print(f"  Creating default shelves for {len(user_ids)} users")
+        # Reserved before the transaction below, since reserving writes to
+        # the primary database
+        shelf_ids = (
+            shard_router.allocate_ids(Shelf.__tablename__, len(user_ids))
+            if shard_router.is_sharded else [None] * len(user_ids)
+        )
+        rows = []
+        for user_id, shelf_id in zip(user_ids, shelf_ids):
+            row = {"user_id": user_id, "name": DEFAULT_SHELF_NAME, "position": 0, "album_count": 0}
+            if shelf_id is not None:
+                row["id"] = shelf_id
+            rows.append(row)
+        with db_engine.begin() as conn:
+            conn.execute(Shelf.__table__.insert(), rows)
+
+    with db_engine.begin() as conn:
+        moved = conn.execute(text(
+            "UPDATE user_albums SET shelf_id = ("
+            "  SELECT shelves.id FROM shelves WHERE shelves.user_id = user_albums.user_id"
+            "  ORDER BY shelves.position, shelves.id LIMIT 1"
+            ") WHERE shelf_id IS NULL"
+        )).rowcount
+        if moved:
+            print(f"  Put {moved} albums on their owner's first shelf")
+        conn.execute(text(
+            "UPDATE shelves SET album_count = ("
+            "  SELECT COUNT(*) FROM user_albums WHERE user_albums.shelf_id = shelves.id"
+            ")"
+        ))
+
+def tighten_constraints(db_engine):
+    with db_engine.begin() as conn:
+        for table in (UserAlbum.__table__, AuthCode.__table__):
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+        if db_engine.dialect.name != 'postgresql':
+            return
+        conn.execute(text("ALTER TABLE user_albums ALTER COLUMN shelf_id SET NOT NULL"))
+        for table, column, referenced in CASCADE_FOREIGN_KEYS:
+            # Default constraint name from the original CREATE TABLE
+            constraint = f"{table}_{column}_fkey"
+            conn.execute(text(
+                f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}, "
+                f"ADD CONSTRAINT {constraint} FOREIGN KEY ({column}) "
+                f"REFERENCES {referenced} (id) ON DELETE CASCADE"
+            ))
+
+def upgrade_databases(engines):
+    """Bring databases created before shelves up to the current schema.
+
+    Each step runs on every database before the next starts, since shelf IDs
+    for sharded setups are allocated past the highest ID on any shard. Safe
+    to run more than once; existing users and albums are kept.
+    """
+    for db_engine in engines:
+        print(f"Upgrading {db_engine.url.render_as_string(hide_password=True)}...")
+        Base.metadata.create_all(bind=db_engine)
+        add_missing_columns(db_engine)
+    for db_engine in engines:
+        create_default_shelves(db_engine)
+        tighten_constraints(db_engine)
+
+if __name__ == "__main__":
+    # The primary database and every shard are upgraded together
+    upgrade_databases(list(dict.fromkeys([engine] + shard_router.engines)))
+    print("Upgrade complete. Restart the FastAPI server.")